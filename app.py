@@ -1,57 +1,191 @@
+import os
+from pathlib import Path
+
 import streamlit as st
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import requests
 
 
 # Carga de conjunto de datos
 
-@st.cache_data
-def cargar_datos():
+CSV_ORIGEN = "establecimientos_20251014.csv"
+PARQUET_RM = "rm_clean.parquet"
+
+# columnas con pocos valores distintos que se guardan como category
+COLUMNAS_CATEGORIA = [
+    "ComunaGlosa",
+    "TipoEstablecimientoGlosa",
+    "SistemaSalud",
+    "NivelAtencionEstabglosa",
+]
+
+# columnas del CSV que realmente se usan en la aplicación
+NEEDED = [
+    "RegionGlosa",
+    "Latitud",
+    "Longitud",
+    "TipoViaGlosa",
+    "NombreVia",
+    "Numero",
+    "DependenciaAdministrativa",
+    "ComunaGlosa",
+    "TipoEstablecimientoGlosa",
+    "NivelAtencionEstabglosa",
+    "EstablecimientoGlosa",
+    "TelefonoMovil_TelefonoFijo",
+]
+
+
+def limpiar_csv():
     """
-    Carga el archivo CSV descargado desde datos.gob.cl
+    Lee el archivo CSV descargado desde datos.gob.cl
     y deja solo los establecimientos de la Región Metropolitana.
     """
+    # motor pyarrow: lee en paralelo y solo las columnas necesarias.
+    # Latitud y Longitud ya quedan numéricas desde la lectura.
     df = pd.read_csv(
-        "establecimientos_20251014.csv",
+        CSV_ORIGEN,
         sep=";",
         encoding="utf-8",
-        encoding_errors="ignore"
+        encoding_errors="ignore",
+        usecols=NEEDED,
+        dtype={"Latitud": "float64", "Longitud": "float64", "Numero": "string"},
+        engine="pyarrow",
+        dtype_backend="pyarrow"
     )
 
     # Filtrar solo para la región metropolitana
     df_rm = df[df["RegionGlosa"].str.contains("Metropolitana", na=False)].copy()
 
-    # Asegurar que latitud y longitud sean numéricas
-    df_rm["Latitud"] = pd.to_numeric(df_rm["Latitud"], errors="coerce")
-    df_rm["Longitud"] = pd.to_numeric(df_rm["Longitud"], errors="coerce")
-
-    # construir dirección a partir de las columnas del CSV
+    # construir dirección a partir de las columnas del CSV (una sola unión con str.cat)
     df_rm["Direccion"] = (
-        df_rm["TipoViaGlosa"].fillna("") + " " +
-        df_rm["NombreVia"].fillna("") + " " +
-        df_rm["Numero"].fillna("").astype(str)
-    ).str.strip()
-
-    # Clasificación entre: Público / Privado / Otro
-    def clasificar(dep):
-        if not isinstance(dep, str):
-            return "Otro"
-        d = dep.lower()
-        if "privad" in d:
-            return "Privado"
-        if "municipal" in d or "servicio de salud" in d or "seremi" in d:
-            return "Público"
-        return "Otro"
-
-    df_rm["SistemaSalud"] = df_rm["DependenciaAdministrativa"].apply(clasificar)
+        df_rm["TipoViaGlosa"].fillna("").str.cat(
+            [df_rm["NombreVia"].fillna(""), df_rm["Numero"].fillna("").astype(str)],
+            sep=" "
+        ).str.strip()
+    )
+
+    # Clasificación entre: Público / Privado / Otro (vectorizada, sin apply)
+    dep = df_rm["DependenciaAdministrativa"].fillna("").str.lower()
+    es_privado = dep.str.contains("privad", regex=False).to_numpy(dtype=bool)
+    es_publico = dep.str.contains("municipal|servicio de salud|seremi", regex=True).to_numpy(dtype=bool)
+    df_rm["SistemaSalud"] = np.select([es_privado, es_publico], ["Privado", "Público"], default="Otro")
 
     return df_rm
 
 
+@st.cache_resource(show_spinner="Cargando centros…")
+def cargar_datos():
+    """
+    Carga los establecimientos de la Región Metropolitana ya limpios
+    desde el parquet. Si no existe se genera una vez a partir del CSV;
+    el parquet es el caché en disco que comparten los procesos, así que
+    un arranque nuevo no vuelve a procesar el CSV (ni lo necesita).
+    Al actualizar el CSV hay que borrar el parquet para regenerarlo.
+
+    Devuelve (df, comunas, tipos, sistemas, niveles): las listas son las
+    opciones ordenadas de los filtros de la barra lateral.
+
+    El DataFrame se comparte entre sesiones sin copiarlo, así que es de
+    solo lectura: quien necesite modificarlo debe trabajar sobre una copia.
+    """
+    parquet = Path(PARQUET_RM)
+    if not parquet.exists():
+        # se escribe a un archivo temporal y se reemplaza, para que otro
+        # proceso nunca lea un parquet a medio escribir
+        temporal = parquet.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            limpiar_csv().to_parquet(temporal, compression="zstd")
+            temporal.replace(parquet)
+        finally:
+            temporal.unlink(missing_ok=True)
+
+    df_rm = pd.read_parquet(parquet, dtype_backend="pyarrow")
+
+    # filtros y conteos trabajan sobre códigos enteros en vez de textos
+    for c in COLUMNAS_CATEGORIA:
+        df_rm[c] = df_rm[c].astype("category")
+
+    # opciones de los filtros: las categorías ya vienen ordenadas y sin vacíos
+    comunas = df_rm["ComunaGlosa"].cat.categories.tolist()
+    tipos = df_rm["TipoEstablecimientoGlosa"].cat.categories.tolist()
+    sistemas = df_rm["SistemaSalud"].cat.categories.tolist()
+    niveles = df_rm["NivelAtencionEstabglosa"].cat.categories.tolist()
+
+    return df_rm, comunas, tipos, sistemas, niveles
+
+
+
+# Filtros
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def aplicar_filtros(nombre, comunas_sel, tipos_sel, sistemas_sel, niveles_sel):
+    """
+    Aplica los filtros de la barra lateral sobre los datos de la RM.
+    Las selecciones llegan como tuplas para que el resultado quede en caché
+    según el estado de los filtros. Devuelve (df_filtrado, top_comunas, df_mapa).
+    """
+    df = cargar_datos()[0]
+
+    # una máscara por filtro, combinadas en un solo arreglo booleano.
+    # Si están todas las opciones elegidas basta con descartar los vacíos,
+    # sin comparar contra cada valor seleccionado.
+    def maybe_isin(col, sel):
+        serie = df[col]
+        if len(sel) == len(serie.cat.categories):
+            return serie.notna().to_numpy()
+        return serie.isin(sel).to_numpy()
+
+    masks = [
+        maybe_isin("ComunaGlosa", comunas_sel),
+        maybe_isin("TipoEstablecimientoGlosa", tipos_sel),
+        maybe_isin("SistemaSalud", sistemas_sel),
+        maybe_isin("NivelAtencionEstabglosa", niveles_sel),
+    ]
+
+    # búsqueda por nombre directo sobre el arreglo Arrow (subcadena, sin regex)
+    if nombre:
+        nombres = pa.array(df["EstablecimientoGlosa"])
+        coincide = pc.match_substring(nombres, nombre, ignore_case=True).fill_null(False)
+        masks.append(coincide.to_numpy(zero_copy_only=False))
+
+    # filtrar ya entrega un DataFrame nuevo, no hace falta copiar la base
+    df_filtrado = df.iloc[np.logical_and.reduce(masks)]
+
+    # conteo por código de categoría sin ordenar, y solo las 5 mayores
+    conteo_comunas = df_filtrado["ComunaGlosa"].value_counts(sort=False)
+    top_comunas = conteo_comunas[conteo_comunas > 0].nlargest(5)
+
+    # puntos del mapa redondeados (~1 m) y sin repetir
+    df_mapa = (
+        df_filtrado[["Latitud", "Longitud"]]
+        .dropna()
+        .assign(lat=lambda d: d["Latitud"].round(5), lon=lambda d: d["Longitud"].round(5))
+        [["lat", "lon"]]
+        .drop_duplicates()
+    )
+
+    return df_filtrado, top_comunas, df_mapa
+
+
 
 # API datos.gob.cl
 
-@st.cache_data
+@st.cache_resource
+def _session():
+    """
+    Sesión HTTP compartida para reutilizar la conexión HTTPS con datos.gob.cl.
+    """
+    s = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    s.mount("https://", adapter)
+    return s
+
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
 def consultar_api_datos_gob(resource_id: str, limit: int = 50):
     """
     Ejemplo de uso de la API REST de datos.gob.cl usando datastore_search.
@@ -60,7 +194,7 @@ def consultar_api_datos_gob(resource_id: str, limit: int = 50):
     params = {"resource_id": resource_id, "limit": limit}
 
     try:
-        r = requests.get(url, params=params, timeout=10)
+        r = _session().get(url, params=params, timeout=10)
     except requests.exceptions.RequestException as e:
         st.error(f"Error de conexión con datos.gob.cl: {e}")
         return None
@@ -79,7 +213,7 @@ def consultar_api_datos_gob(resource_id: str, limit: int = 50):
         st.info("La API no devolvió registros para este recurso.")
         return None
 
-    return pd.DataFrame(records)
+    return pd.DataFrame.from_records(records)
 
 
 
@@ -115,19 +249,14 @@ st.html(
 )
 
 
-df = cargar_datos()
+# opciones de los filtros, calculadas una vez junto con la carga
+df, comunas, tipos, sistemas, niveles = cargar_datos()
 
 
 # Filtros aplicados en la barra lateral
 
 st.sidebar.header("Filtros")
 
-# opciones
-comunas = sorted(df["ComunaGlosa"].dropna().unique())
-tipos = sorted(df["TipoEstablecimientoGlosa"].dropna().unique())
-sistemas = sorted(df["SistemaSalud"].dropna().unique())
-niveles = sorted(df["NivelAtencionEstabglosa"].dropna().unique())
-
 nombre_filtro = st.sidebar.text_input("Buscar por nombre")
 
 comunas_sel = st.sidebar.multiselect("Comuna", comunas, default=comunas)
@@ -142,22 +271,14 @@ orden_dir = st.sidebar.radio("Dirección", ["A → Z", "Z → A"], horizontal=Tr
 columna_orden = "EstablecimientoGlosa" if orden_campo == "Nombre" else "ComunaGlosa"
 asc = True if orden_dir.startswith("A") else False
 
-# aplicar filtros
-df_filtrado = df.copy()
-
-if nombre_filtro:
-    df_filtrado = df_filtrado[
-        df_filtrado["EstablecimientoGlosa"].str.contains(nombre_filtro, case=False, na=False)
-    ]
-
-df_filtrado = df_filtrado[
-    df_filtrado["ComunaGlosa"].isin(comunas_sel)
-    & df_filtrado["TipoEstablecimientoGlosa"].isin(tipos_sel)
-    & df_filtrado["SistemaSalud"].isin(sistemas_sel)
-    & df_filtrado["NivelAtencionEstabglosa"].isin(niveles_sel)
-]
-
-df_filtrado = df_filtrado.sort_values(by=columna_orden, ascending=asc)
+# aplicar filtros (en caché según el estado de los filtros)
+df_filtrado, top_comunas, df_mapa = aplicar_filtros(
+    nombre_filtro,
+    tuple(comunas_sel),
+    tuple(tipos_sel),
+    tuple(sistemas_sel),
+    tuple(niveles_sel),
+)
 
 
 # Resumen (como métricas simples)
@@ -165,9 +286,10 @@ df_filtrado = df_filtrado.sort_values(by=columna_orden, ascending=asc)
 st.subheader("Resumen (datos filtrados)")
 
 c1, c2, c3 = st.columns(3)
+conteo_sistema = df_filtrado["SistemaSalud"].value_counts()
 c1.metric("Total establecimientos", len(df_filtrado))
-c2.metric("Públicos", int((df_filtrado["SistemaSalud"] == "Público").sum()))
-c3.metric("Privados", int((df_filtrado["SistemaSalud"] == "Privado").sum()))
+c2.metric("Públicos", int(conteo_sistema.get("Público", 0)))
+c3.metric("Privados", int(conteo_sistema.get("Privado", 0)))
 
 
 # Mapa y gráfico
@@ -176,20 +298,19 @@ col_mapa, col_graf = st.columns([2, 1])
 
 with col_mapa:
     st.markdown("### Mapa de centros de salud")
-    df_mapa = df_filtrado.dropna(subset=["Latitud", "Longitud"]).copy()
     if df_mapa.empty:
         st.info("No hay establecimientos con coordenadas para los filtros seleccionados.")
     else:
-        df_mapa = df_mapa.rename(columns={"Latitud": "lat", "Longitud": "lon"})
-        st.map(df_mapa[["lat", "lon"]], zoom=10)
+        st.map(df_mapa, zoom=10)
 
 st.subheader("Top 5 comunas con más centros de salud")
-top_comunas = df_filtrado["ComunaGlosa"].value_counts().head(5)
 st.bar_chart(top_comunas)
 
 
 # Tabla debajo
 
+MAX_FILAS_TABLA = 500
+
 st.markdown("### Tabla de establecimientos (detalle)")
 
 columnas_tabla = [
@@ -203,7 +324,14 @@ columnas_tabla = [
 ]
 
 cols_existentes = [c for c in columnas_tabla if c in df_filtrado.columns]
-st.dataframe(df_filtrado[cols_existentes], use_container_width=True)
+# solo la tabla necesita orden: se ordena la proyección que se muestra
+# y se envían al navegador como máximo MAX_FILAS_TABLA filas
+st.dataframe(
+    df_filtrado[cols_existentes].sort_values(by=columna_orden, ascending=asc).head(MAX_FILAS_TABLA),
+    use_container_width=True
+)
+if len(df_filtrado) > MAX_FILAS_TABLA:
+    st.caption(f"Mostrando {MAX_FILAS_TABLA} de {len(df_filtrado)} filas")
 
 
 # La opción del Feedback